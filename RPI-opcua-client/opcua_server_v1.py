@@ -7,11 +7,10 @@ Reads PZEM data and sends to OPC-UA Server
 import asyncio
 import logging
 import time
-import threading
 import serial
 import struct
-from datetime import datetime
-from asyncua import Client
+from datetime import datetime, timezone
+from asyncua import Client, ua
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
@@ -21,30 +20,64 @@ logger = logging.getLogger(__name__)
 OPCUA_SERVER_URL = "opc.tcp://192.168.1.207:4840/UA"
 SAMPLE_INTERVAL = 2.0  # seconds
 
+# PZEM response frame: 3-byte header, then voltage (u16), current (u24),
+# power (u24), energy (u24), frequency (u16) and power factor (u16).
+# 24-bit fields are split into a high byte and a low word.
+PZEM_FRAME = struct.Struct('>xxxHBHxBHxBHxHH')
+unpack_pzem_frame = PZEM_FRAME.unpack_from
+
+
+def _crc16_byte(value):
+    crc = value
+    for _ in range(8):
+        crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+# Table-driven Modbus RTU CRC-16 (polynomial 0xA001, reflected)
+CRC16_TABLE = tuple(_crc16_byte(i) for i in range(256))
+
+
+def modbus_crc16(data):
+    """Return the Modbus RTU CRC-16 of data"""
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ byte) & 0xFF]
+    return crc
+
+
 class PZEMReader:
     """Your existing PZEM reader - adapted from your server code"""
 
     def __init__(self, device='/dev/ttyAMA0'):
         self.device = device
-        self.latest_data = {}
-        self.running = False
+        self.queue = asyncio.Queue(maxsize=1)
+        self._stop = asyncio.Event()
+        self._ser = None
 
     def decode_pzem_response(self, response_hex):
         if isinstance(response_hex, str):
-            data = bytes.fromhex(response_hex.replace(' ', ''))
+            data = bytes.fromhex(response_hex)
         else:
             data = response_hex
 
         if len(data) < 25:
             return "Response too short"
 
+        # The frame ends with its CRC, low byte first
+        if modbus_crc16(data[:23]) != int.from_bytes(data[23:25], 'little'):
+            return "CRC error"
+
         try:
-            voltage = struct.unpack('>H', data[3:5])[0] / 10.0
-            current = struct.unpack('>I', b'\x00' + data[5:8])[0] / 1000.0
-            power = struct.unpack('>I', b'\x00' + data[9:12])[0] / 10.0
-            energy = struct.unpack('>I', b'\x00' + data[13:16])[0]
-            frequency = struct.unpack('>H', data[17:19])[0] / 10.0
-            power_factor = struct.unpack('>H', data[19:21])[0] / 100.0
+            (voltage_raw, current_hi, current_lo, power_hi, power_lo,
+             energy_hi, energy_lo, frequency_raw, pf_raw) = unpack_pzem_frame(data)
+
+            voltage = voltage_raw / 10.0
+            current = ((current_hi << 16) | current_lo) / 1000.0
+            power = ((power_hi << 16) | power_lo) / 10.0
+            energy = (energy_hi << 16) | energy_lo
+            frequency = frequency_raw / 10.0
+            power_factor = pf_raw / 100.0
 
             return {
                 'voltage': voltage,
@@ -61,54 +94,87 @@ class PZEMReader:
 
     def read_pzem_data(self):
         try:
-            ser = serial.Serial(self.device, 9600, timeout=2)
+            # Keep the port open between reads; reopen only after an error
+            if self._ser is None or not self._ser.is_open:
+                self._ser = serial.Serial(self.device, 9600, timeout=0.5)
+                self._set_low_latency(self._ser)
+            ser = self._ser
             command = bytes([0x01, 0x04, 0x00, 0x00, 0x00, 0x0A, 0x70, 0x0D])
+            ser.reset_input_buffer()
             ser.write(command)
-            time.sleep(0.2)
+            # read() returns as soon as the full frame is in, or after the timeout
             response = ser.read(25)
-            ser.close()
 
             if response:
                 return self.decode_pzem_response(response)
             else:
                 return {"status": "No response"}
         except Exception as e:
+            self.close()
             return {"status": f"Error: {e}"}
 
-    def start_reading(self):
-        self.running = True
-        thread = threading.Thread(target=self._read_loop)
-        thread.daemon = True
-        thread.start()
+    def _set_low_latency(self, ser):
+        """Ask the driver for ASYNC_LOW_LATENCY so short Modbus replies are not held back"""
+        try:
+            ser.set_low_latency_mode(True)
+        except Exception as e:
+            logger.debug("Low latency mode not available on %s: %s", self.device, e)
+
+    def close(self):
+        """Close the serial port if it is open"""
+        if self._ser is not None:
+            try:
+                self._ser.close()
+            finally:
+                self._ser = None
+
+    def _publish(self, data):
+        """Queue a reading, replacing one the consumer has not picked up yet"""
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(data)
+
+    async def read_loop(self):
+        """Read the PZEM in the default executor and queue every reading"""
+        loop = asyncio.get_running_loop()
+        self._stop.clear()
         logger.info("PZEM reading started")
 
-    def _read_loop(self):
-        while self.running:
+        while not self._stop.is_set():
             try:
-                data = self.read_pzem_data()
+                data = await loop.run_in_executor(None, self.read_pzem_data)
                 if isinstance(data, dict) and 'voltage' in data:
-                    self.latest_data = data
-                    logger.info(f"PZEM: {data['voltage']:.1f}V, {data['current']:.3f}A, {data['power']:.1f}W")
+                    logger.info("PZEM: %.1fV, %.3fA, %.1fW", data['voltage'], data['current'], data['power'])
                 else:
-                    self.latest_data = {"status": str(data)}
-                    logger.warning(f"PZEM error: {data}")
+                    logger.warning("PZEM error: %s", data)
+                    data = {"status": str(data)}
             except Exception as e:
-                logger.error(f"PZEM read error: {e}")
-                self.latest_data = {"status": f"Error: {e}"}
-            time.sleep(2)
+                logger.error("PZEM read error: %s", e)
+                data = {"status": f"Error: {e}"}
+            self._publish(data)
+
+            # Wait for the next poll, returning straight away once stop() is called
+            try:
+                await asyncio.wait_for(self._stop.wait(), SAMPLE_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
 
-    def get_latest_data(self):
-        return self.latest_data
+    def stop(self):
+        """Ask read_loop to exit after the read in progress, if any"""
+        self._stop.set()
 
 class EnergyMonitor:
     def __init__(self):
         self.opcua_client = None
+        self.read_task = None
         self.pzem_reader = PZEMReader(device='/dev/ttyAMA0')  # Using your existing PZEM reader
         self.nodes = {}
+        self.node_vt = {}
+        self._write_params = None
 
-    def get_pzem_data(self):
-        """Get current PZEM readings"""
-        return self.pzem_reader.get_latest_data()
+    async def get_pzem_data(self):
+        """Wait for the next PZEM reading"""
+        return await self.pzem_reader.queue.get()
 
     async def connect_opcua(self):
         """Connect to Windows OPC-UA server"""
@@ -129,6 +195,26 @@ class EnergyMonitor:
                 'timestamp': self.opcua_client.get_node("ns=1;s=VirtualEnergyMeter.LastUpdate")
             }
 
+            # Variant types are fixed per node, so resolve them once here
+            self.node_vt = {
+                'voltage': ua.VariantType.Double,
+                'current': ua.VariantType.Double,
+                'power': ua.VariantType.Double,
+                'energy': ua.VariantType.Double,
+                'frequency': ua.VariantType.Double,
+                'power_factor': ua.VariantType.Double,
+                'status': ua.VariantType.String,
+                'timestamp': ua.VariantType.String
+            }
+
+            # Build the WriteRequest body once; each send only swaps in new DataValues
+            self._write_params = ua.WriteParameters()
+            for node in self.nodes.values():
+                write_value = ua.WriteValue()
+                write_value.NodeId = node.nodeid
+                write_value.AttributeId = ua.AttributeIds.Value
+                self._write_params.NodesToWrite.append(write_value)
+
             logger.info("✅ Connected to OPC-UA server")
             return True
 
@@ -146,18 +232,28 @@ class EnergyMonitor:
             energy = float(data.get('energy', 0.0))
             frequency = float(data.get('frequency', 50.0))
             power_factor = float(data.get('power_factor', 1.0))
-            timestamp_str = datetime.now().isoformat()
+            timestamp_str = datetime.fromtimestamp(data.get('timestamp', time.time())).isoformat()
             status_str = str(data.get('status', 'OK'))
 
-            # Send all data to OPC-UA nodes
-            await self.nodes['voltage'].write_value(voltage)
-            await self.nodes['current'].write_value(current)
-            await self.nodes['power'].write_value(power)
-            await self.nodes['energy'].write_value(energy)
-            await self.nodes['frequency'].write_value(frequency)
-            await self.nodes['power_factor'].write_value(power_factor)
-            await self.nodes['status'].write_value(status_str)
-            await self.nodes['timestamp'].write_value(timestamp_str)
+            values = {
+                'voltage': voltage,
+                'current': current,
+                'power': power,
+                'energy': energy,
+                'frequency': frequency,
+                'power_factor': power_factor,
+                'status': status_str,
+                'timestamp': timestamp_str
+            }
+
+            # Send all data to OPC-UA nodes in a single WriteRequest
+            source_timestamp = datetime.now(timezone.utc)
+            for key, write_value in zip(self.nodes, self._write_params.NodesToWrite):
+                write_value.Value = ua.DataValue(ua.Variant(values[key], self.node_vt[key]), SourceTimestamp=source_timestamp)
+
+            results = await self.opcua_client.uaclient.write(self._write_params)
+            for result in results:
+                result.check()
 
             return True
 
@@ -171,22 +267,20 @@ class EnergyMonitor:
 
         # Start PZEM reading first
         logger.info("Starting PZEM reader...")
-        self.pzem_reader.start_reading()
-
-        # Wait a moment for PZEM to get first reading
-        await asyncio.sleep(3)
-
-        # Connect to OPC-UA server
-        if not await self.connect_opcua():
-            logger.error("Cannot connect to OPC-UA server. Exiting.")
-            return
+        self.read_task = asyncio.create_task(self.pzem_reader.read_loop())
 
         reading_count = 0
 
         try:
+            # Connect to OPC-UA server (inside the try so a failed connect still
+            # stops the reader and closes the serial port)
+            if not await self.connect_opcua():
+                logger.error("Cannot connect to OPC-UA server. Exiting.")
+                return
+
             while True:
-                # Read PZEM data
-                pzem_data = self.get_pzem_data()
+                # Wait for the next PZEM reading
+                pzem_data = await self.get_pzem_data()
 
                 if pzem_data and 'voltage' in pzem_data:
                     # Send to OPC-UA server
@@ -195,23 +289,22 @@ class EnergyMonitor:
 
                         # Log every 5 readings
                         if reading_count % 5 == 0:
-                            logger.info(f"Reading #{reading_count}: "
-                                      f"V={pzem_data['voltage']:.1f}V, "
-                                      f"I={pzem_data['current']:.3f}A, "
-                                      f"P={pzem_data['power']:.0f}W")
+                            logger.info("Reading #%d: V=%.1fV, I=%.3fA, P=%.0fW",
+                                        reading_count, pzem_data['voltage'],
+                                        pzem_data['current'], pzem_data['power'])
                 else:
                     logger.warning("No PZEM data available")
 
-                # Wait for next reading
-                await asyncio.sleep(SAMPLE_INTERVAL)
-
         except KeyboardInterrupt:
             logger.info("Stopping...")
         except Exception as e:
             logger.error(f"Unexpected error: {e}")
         finally:
             # Stop PZEM reading
-            self.pzem_reader.running = False
+            self.pzem_reader.stop()
+            if self.read_task:
+                await asyncio.gather(self.read_task, return_exceptions=True)
+            self.pzem_reader.close()
             if self.opcua_client:
                 await self.opcua_client.disconnect()
                 logger.info("Disconnected from OPC-UA server")
@@ -8,18 +8,48 @@ Now with configurable settings via config file and environment variables
 import asyncio
 import logging
 import time
-import threading
 import serial
 import struct
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timezone
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Dict, Any, Optional
-from asyncua import Client
+from asyncua import Client, ua
 from logging.handlers import RotatingFileHandler
 from dotenv import load_dotenv
 
+# orjson is optional; fall back to the stdlib parser when it is not installed
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+# Sentinel for ConfigManager.get, so stored None values are returned as-is
+_MISSING = object()
+
+# Environment overrides: (variable, config path, converter or None)
+ENV_OVERRIDES = (
+    # Sensitive/Environment-specific settings only
+    ('OPCUA_SERVER_URL', ('opcua', 'server_url'), None),
+    ('OPCUA_USERNAME', ('opcua', 'username'), None),
+    ('OPCUA_PASSWORD', ('opcua', 'password'), None),
+    ('PZEM_DEVICE', ('pzem', 'device'), None),
+    ('LOG_LEVEL', ('logging', 'level'), None),
+    ('ENVIRONMENT', ('application', 'environment'), None),
+
+    # Optional overrides for any config.json setting
+    ('SAMPLE_INTERVAL', ('timing', 'pzem_read_interval'), float),
+    ('ENABLE_FILE_LOGGING', ('logging', 'enable_file_logging'), lambda x: x.lower() == 'true'),
+    ('LOG_EVERY_N_READINGS', ('logging', 'log_every_n_readings'), int),
+    ('OPCUA_TIMEOUT', ('opcua', 'connection', 'timeout'), int),
+    ('OPCUA_RETRY_ATTEMPTS', ('opcua', 'connection', 'retry_attempts'), int),
+    ('PZEM_BAUDRATE', ('pzem', 'serial', 'baudrate'), int),
+    ('PZEM_TIMEOUT', ('pzem', 'serial', 'timeout'), float),
+)
+
 class ConfigManager:
     """Manages configuration from both JSON file and environment variables"""
     
@@ -27,6 +57,7 @@ class ConfigManager:
         self.config_file = config_file
         self.env_file = env_file
         self.config = {}
+        self.flat = SimpleNamespace()
         self.load_config()
     
     def load_config(self):
@@ -34,8 +65,8 @@ class ConfigManager:
         # Load from JSON file first
         if Path(self.config_file).exists():
             try:
-                with open(self.config_file, 'r') as f:
-                    self.config = json.load(f)
+                with open(self.config_file, 'rb') as f:
+                    self.config = json_loads(f.read())
                 print(f"✅ Loaded config from {self.config_file}")
             except Exception as e:
                 print(f"⚠️  Error loading config file: {e}")
@@ -51,6 +82,9 @@ class ConfigManager:
         
         # Override with environment variables
         self._apply_env_overrides()
+
+        # Resolve runtime settings once so consumers use plain attribute access
+        self.flat = self._build_flat()
     
     def _get_default_config(self) -> Dict[str, Any]:
         """Default configuration"""
@@ -82,15 +116,13 @@ class ConfigManager:
                 "device": "/dev/ttyAMA0",
                 "serial": {
                     "baudrate": 9600,
-                    "timeout": 2
+                    "timeout": 0.5
                 },
                 "protocol": {
-                    "read_delay": 0.2
+                    "low_latency": True
                 }
             },
             "timing": {
-                "sample_interval": 2.0,
-                "startup_delay": 3,
                 "pzem_read_interval": 2
             },
             "logging": {
@@ -104,68 +136,95 @@ class ConfigManager:
     
     def _apply_env_overrides(self):
         """Override config values with environment variables (only sensitive/environment-specific ones)"""
-        env_mappings = {
-            # Sensitive/Environment-specific settings only
-            'OPCUA_SERVER_URL': ('opcua', 'server_url'),
-            'OPCUA_USERNAME': ('opcua', 'username'),
-            'OPCUA_PASSWORD': ('opcua', 'password'),
-            'PZEM_DEVICE': ('pzem', 'device'),
-            'LOG_LEVEL': ('logging', 'level'),
-            'ENVIRONMENT': ('application', 'environment'),
-            
-            # Optional overrides for any config.json setting
-            'SAMPLE_INTERVAL': ('timing', 'sample_interval', float),
-            'ENABLE_FILE_LOGGING': ('logging', 'enable_file_logging', lambda x: x.lower() == 'true'),
-            'LOG_EVERY_N_READINGS': ('logging', 'log_every_n_readings', int),
-            'OPCUA_TIMEOUT': ('opcua', 'connection', 'timeout', int),
-            'OPCUA_RETRY_ATTEMPTS': ('opcua', 'connection', 'retry_attempts', int),
-            'PZEM_BAUDRATE': ('pzem', 'serial', 'baudrate', int),
-            'PZEM_TIMEOUT': ('pzem', 'serial', 'timeout', int),
-            'PZEM_READ_DELAY': ('pzem', 'protocol', 'read_delay', float),
-        }
-        
-        for env_var, config_path in env_mappings.items():
-            value = os.getenv(env_var)
-            if value is not None:
+        getenv = os.environ.get
+        for env_var, config_path, converter in ENV_OVERRIDES:
+            value = getenv(env_var)
+            if value is None:
+                continue
+
+            # Handle type conversion
+            if converter is not None:
                 try:
-                    # Handle type conversion
-                    if len(config_path) > 2 and callable(config_path[2]):
-                        try:
-                            value = config_path[2](value)
-                        except (ValueError, TypeError):
-                            print(f"⚠️  Invalid value for {env_var}: {value}")
-                            continue
-                    
-                    # Set nested config value safely
-                    config_section = self.config
-                    for i, key in enumerate(config_path[:-1]):
-                        if key not in config_section:
-                            config_section[key] = {}
-                        elif not isinstance(config_section[key], dict):
-                            # If the path exists but isn't a dict, create a new dict
-                            print(f"⚠️  Overriding non-dict value at path: {'.'.join(config_path[:i+1])}")
-                            config_section[key] = {}
-                        config_section = config_section[key]
-                    
-                    # Set the final value
-                    final_key = config_path[-1]
-                    config_section[final_key] = value
-                    print(f"🔧 Environment override: {env_var} = {value}")
-                    
-                except Exception as e:
-                    print(f"❌ Error setting {env_var} to path {'.'.join(config_path)}: {e}")
-                    print(f"   Current config section type: {type(config_section)}")
+                    value = converter(value)
+                except (ValueError, TypeError):
+                    print(f"⚠️  Invalid value for {env_var}: {value}")
                     continue
+
+            try:
+                # Set nested config value safely
+                config_section = self.config
+                for i, key in enumerate(config_path[:-1]):
+                    if key not in config_section:
+                        config_section[key] = {}
+                    elif not isinstance(config_section[key], dict):
+                        # If the path exists but isn't a dict, create a new dict
+                        print(f"⚠️  Overriding non-dict value at path: {'.'.join(config_path[:i+1])}")
+                        config_section[key] = {}
+                    config_section = config_section[key]
+
+                # Set the final value
+                final_key = config_path[-1]
+                config_section[final_key] = value
+                print(f"🔧 Environment override: {env_var} = {value}")
+
+            except Exception as e:
+                print(f"❌ Error setting {env_var} to path {'.'.join(config_path)}: {e}")
+                print(f"   Current config section type: {type(config_section)}")
+                continue
     
+    def _build_flat(self) -> SimpleNamespace:
+        """Resolve runtime settings, with their defaults, into a flat namespace"""
+        return SimpleNamespace(
+            pzem_device=self.get('pzem', 'device', default='/dev/ttyAMA0'),
+            pzem_baudrate=self.get('pzem', 'serial', 'baudrate', default=9600),
+            pzem_timeout=self.get('pzem', 'serial', 'timeout', default=0.5),
+            pzem_low_latency=self.get('pzem', 'protocol', 'low_latency', default=True),
+            sample_interval=self.get('timing', 'pzem_read_interval', default=2),
+            opcua_url=self.get('opcua', 'server_url'),
+            opcua_username=self.get('opcua', 'username'),
+            opcua_password=self.get('opcua', 'password'),
+            opcua_nodes=self.get('opcua', 'nodes', default={}),
+            opcua_retry_attempts=self.get('opcua', 'connection', 'retry_attempts', default=3),
+            opcua_retry_delay=self.get('opcua', 'connection', 'retry_delay', default=5),
+            log_every_n=self.get('logging', 'log_every_n_readings', default=5),
+        )
+
     def get(self, *keys, default=None):
         """Get nested configuration value"""
         value = self.config
-        try:
-            for key in keys:
-                value = value[key]
-            return value
-        except (KeyError, TypeError):
-            return default
+        for key in keys:
+            if not isinstance(value, dict):
+                return default
+            value = value.get(key, _MISSING)
+            if value is _MISSING:
+                return default
+        return value
+
+
+# PZEM response frame: 3-byte header, then voltage (u16), current (u24),
+# power (u24), energy (u24), frequency (u16) and power factor (u16).
+# 24-bit fields are split into a high byte and a low word.
+PZEM_FRAME = struct.Struct('>xxxHBHxBHxBHxHH')
+unpack_pzem_frame = PZEM_FRAME.unpack_from
+
+
+def _crc16_byte(value):
+    crc = value
+    for _ in range(8):
+        crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+# Table-driven Modbus RTU CRC-16 (polynomial 0xA001, reflected)
+CRC16_TABLE = tuple(_crc16_byte(i) for i in range(256))
+
+
+def modbus_crc16(data):
+    """Return the Modbus RTU CRC-16 of data"""
+    crc = 0xFFFF
+    for byte in data:
+        crc = (crc >> 8) ^ CRC16_TABLE[(crc ^ byte) & 0xFF]
+    return crc
 
 
 class PZEMReader:
@@ -173,32 +232,40 @@ class PZEMReader:
 
     def __init__(self, config: ConfigManager):
         self.config = config
-        self.device = config.get('pzem', 'device', default='/dev/ttyAMA0')
-        self.baudrate = config.get('pzem', 'serial', 'baudrate', default=9600)
-        self.timeout = config.get('pzem', 'serial', 'timeout', default=2)
-        self.read_delay = config.get('pzem', 'protocol', 'read_delay', default=0.2)
-        self.read_interval = config.get('timing', 'pzem_read_interval', default=2)
+        self.device = config.flat.pzem_device
+        self.baudrate = config.flat.pzem_baudrate
+        self.timeout = config.flat.pzem_timeout
+        self.low_latency = config.flat.pzem_low_latency
+        self.read_interval = config.flat.sample_interval
         
-        self.latest_data = {}
-        self.running = False
+        self.queue = asyncio.Queue(maxsize=1)
+        self._stop = asyncio.Event()
+        self._ser = None
         self.logger = logging.getLogger(self.__class__.__name__)
 
     def decode_pzem_response(self, response_hex):
         if isinstance(response_hex, str):
-            data = bytes.fromhex(response_hex.replace(' ', ''))
+            data = bytes.fromhex(response_hex)
         else:
             data = response_hex
 
         if len(data) < 25:
             return "Response too short"
 
+        # The frame ends with its CRC, low byte first
+        if modbus_crc16(data[:23]) != int.from_bytes(data[23:25], 'little'):
+            return "CRC error"
+
         try:
-            voltage = struct.unpack('>H', data[3:5])[0] / 10.0
-            current = struct.unpack('>I', b'\x00' + data[5:8])[0] / 1000.0
-            power = struct.unpack('>I', b'\x00' + data[9:12])[0] / 10.0
-            energy = struct.unpack('>I', b'\x00' + data[13:16])[0]
-            frequency = struct.unpack('>H', data[17:19])[0] / 10.0
-            power_factor = struct.unpack('>H', data[19:21])[0] / 100.0
+            (voltage_raw, current_hi, current_lo, power_hi, power_lo,
+             energy_hi, energy_lo, frequency_raw, pf_raw) = unpack_pzem_frame(data)
+
+            voltage = voltage_raw / 10.0
+            current = ((current_hi << 16) | current_lo) / 1000.0
+            power = ((power_hi << 16) | power_lo) / 10.0
+            energy = (energy_hi << 16) | energy_lo
+            frequency = frequency_raw / 10.0
+            power_factor = pf_raw / 100.0
 
             return {
                 'voltage': voltage,
@@ -215,44 +282,79 @@ class PZEMReader:
 
     def read_pzem_data(self):
         try:
-            ser = serial.Serial(self.device, self.baudrate, timeout=self.timeout)
+            # Keep the port open between reads; reopen only after an error
+            if self._ser is None or not self._ser.is_open:
+                self._ser = serial.Serial(self.device, self.baudrate, timeout=self.timeout)
+                if self.low_latency:
+                    self._set_low_latency(self._ser)
+            ser = self._ser
             command = bytes([0x01, 0x04, 0x00, 0x00, 0x00, 0x0A, 0x70, 0x0D])
+            ser.reset_input_buffer()
             ser.write(command)
-            time.sleep(self.read_delay)
+            # read() returns as soon as the full frame is in, or after the timeout
             response = ser.read(25)
-            ser.close()
 
             if response:
                 return self.decode_pzem_response(response)
             else:
                 return {"status": "No response"}
         except Exception as e:
+            self.close()
             return {"status": f"Error: {e}"}
 
-    def start_reading(self):
-        self.running = True
-        thread = threading.Thread(target=self._read_loop)
-        thread.daemon = True
-        thread.start()
+    def _set_low_latency(self, ser):
+        """Ask the driver for ASYNC_LOW_LATENCY so short Modbus replies are not held back"""
+        try:
+            ser.set_low_latency_mode(True)
+        except Exception as e:
+            self.logger.debug("Low latency mode not available on %s: %s", self.device, e)
+
+    def close(self):
+        """Close the serial port if it is open"""
+        if self._ser is not None:
+            try:
+                self._ser.close()
+            finally:
+                self._ser = None
+
+    def _publish(self, data):
+        """Queue a reading, replacing one the consumer has not picked up yet"""
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(data)
+
+    async def read_loop(self):
+        """Read the PZEM in the default executor and queue every reading"""
+        loop = asyncio.get_running_loop()
+        self._stop.clear()
         self.logger.info(f"PZEM reading started on {self.device}")
 
-    def _read_loop(self):
-        while self.running:
+        while not self._stop.is_set():
             try:
-                data = self.read_pzem_data()
+                data = await loop.run_in_executor(None, self.read_pzem_data)
                 if isinstance(data, dict) and 'voltage' in data:
-                    self.latest_data = data
-                    self.logger.debug(f"PZEM: {data['voltage']:.1f}V, {data['current']:.3f}A, {data['power']:.1f}W")
+                    self.logger.debug("PZEM: %.1fV, %.3fA, %.1fW", data['voltage'], data['current'], data['power'])
                 else:
-                    self.latest_data = {"status": str(data)}
-                    self.logger.warning(f"PZEM error: {data}")
+                    self.logger.warning("PZEM error: %s", data)
+                    data = {"status": str(data)}
             except Exception as e:
-                self.logger.error(f"PZEM read error: {e}")
-                self.latest_data = {"status": f"Error: {e}"}
-            time.sleep(self.read_interval)
+                self.logger.error("PZEM read error: %s", e)
+                data = {"status": f"Error: {e}"}
+            self._publish(data)
+
+            # Wait for the next poll, returning straight away once stop() is called
+            try:
+                await asyncio.wait_for(self._stop.wait(), self.read_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    def stop(self):
+        """Ask read_loop to exit after the read in progress, if any"""
+        self._stop.set()
 
-    def get_latest_data(self):
-        return self.latest_data
+
+# Values produced by send_data_to_opcua; configured nodes outside this set are not written
+OPCUA_VALUE_KEYS = ('voltage', 'current', 'power', 'energy', 'frequency', 'power_factor', 'status', 'timestamp')
 
 
 class EnergyMonitor:
@@ -260,18 +362,23 @@ class EnergyMonitor:
         self.config = config
         self.opcua_client = None
         self.pzem_reader = PZEMReader(config)
+        self.read_task = None
         self.nodes = {}
+        self.node_vt = {}
+        self._write_keys = []
+        self._write_params = None
         self.logger = logging.getLogger(self.__class__.__name__)
 
-    def get_pzem_data(self):
-        """Get current PZEM readings"""
-        return self.pzem_reader.get_latest_data()
+    async def get_pzem_data(self):
+        """Wait for the next PZEM reading"""
+        return await self.pzem_reader.queue.get()
 
     async def connect_opcua(self):
         """Connect to Windows OPC-UA server with retry logic"""
-        server_url = self.config.get('opcua', 'server_url')
-        retry_attempts = self.config.get('opcua', 'connection', 'retry_attempts', default=3)
-        retry_delay = self.config.get('opcua', 'connection', 'retry_delay', default=5)
+        flat = self.config.flat
+        server_url = flat.opcua_url
+        retry_attempts = flat.opcua_retry_attempts
+        retry_delay = flat.opcua_retry_delay
         
         for attempt in range(retry_attempts):
             try:
@@ -279,8 +386,8 @@ class EnergyMonitor:
                 self.opcua_client = Client(url=server_url)
                 
                 # Set authentication if provided
-                username = self.config.get('opcua', 'username')
-                password = self.config.get('opcua', 'password')
+                username = flat.opcua_username
+                password = flat.opcua_password
                 if username and password:
                     self.opcua_client.set_user(username)
                     self.opcua_client.set_password(password)
@@ -289,14 +396,25 @@ class EnergyMonitor:
                 await self.opcua_client.connect()
 
                 # Get node references
-                node_ids = self.config.get('opcua', 'nodes', default={})
+                node_ids = flat.opcua_nodes
                 for node_name, node_id in node_ids.items():
                     try:
                         self.nodes[node_name] = self.opcua_client.get_node(node_id)
+                        self.node_vt[node_name] = (ua.VariantType.String if node_name in ('status', 'timestamp')
+                                                   else ua.VariantType.Double)
                         self.logger.debug(f"Node '{node_name}' mapped to {node_id}")
                     except Exception as e:
                         self.logger.warning(f"Failed to map node '{node_name}': {e}")
 
+                # Build the WriteRequest body once; each send only swaps in new DataValues
+                self._write_keys = [key for key in OPCUA_VALUE_KEYS if key in self.nodes]
+                self._write_params = ua.WriteParameters()
+                for key in self._write_keys:
+                    write_value = ua.WriteValue()
+                    write_value.NodeId = self.nodes[key].nodeid
+                    write_value.AttributeId = ua.AttributeIds.Value
+                    self._write_params.NodesToWrite.append(write_value)
+
                 self.logger.info("✅ Connected to OPC-UA server")
                 return True
 
@@ -320,17 +438,19 @@ class EnergyMonitor:
                 'frequency': float(data.get('frequency', 50.0)),
                 'power_factor': float(data.get('power_factor', 1.0)),
                 'status': str(data.get('status', 'OK')),
-                'timestamp': datetime.now().isoformat()
+                'timestamp': datetime.fromtimestamp(data.get('timestamp', time.time())).isoformat()
             }
 
-            # Send all data to OPC-UA nodes
-            for key, value in values.items():
-                if key in self.nodes:
-                    try:
-                        await self.nodes[key].write_value(value)
-                    except Exception as e:
-                        self.logger.warning(f"Failed to write {key}: {e}")
-                        return False
+            # Send all data to OPC-UA nodes in a single WriteRequest
+            source_timestamp = datetime.now(timezone.utc)
+            for key, write_value in zip(self._write_keys, self._write_params.NodesToWrite):
+                write_value.Value = ua.DataValue(ua.Variant(values[key], self.node_vt[key]), SourceTimestamp=source_timestamp)
+
+            results = await self.opcua_client.uaclient.write(self._write_params)
+            for key, result in zip(self._write_keys, results):
+                if not result.is_good():
+                    self.logger.warning("Failed to write %s: %s", key, result)
+                    return False
 
             return True
 
@@ -346,28 +466,23 @@ class EnergyMonitor:
 
         # Start PZEM reading first
         self.logger.info("Starting PZEM reader...")
-        self.pzem_reader.start_reading()
-
-        # Wait for PZEM to get first reading
-        startup_delay = self.config.get('timing', 'startup_delay', default=3)
-        self.logger.info(f"Waiting {startup_delay} seconds for PZEM initialization...")
-        await asyncio.sleep(startup_delay)
-
-        # Connect to OPC-UA server
-        if not await self.connect_opcua():
-            self.logger.error("Cannot connect to OPC-UA server. Exiting.")
-            return
+        self.read_task = asyncio.create_task(self.pzem_reader.read_loop())
 
         reading_count = 0
-        sample_interval = self.config.get('timing', 'sample_interval', default=2.0)
-        log_every_n = self.config.get('logging', 'log_every_n_readings', default=5)
+        log_every_n = self.config.flat.log_every_n
         
-        self.logger.info(f"Starting main loop with {sample_interval}s interval")
-
         try:
+            # Connect to OPC-UA server (inside the try so a failed connect still
+            # stops the reader and closes the serial port)
+            if not await self.connect_opcua():
+                self.logger.error("Cannot connect to OPC-UA server. Exiting.")
+                return
+
+            self.logger.info(f"Starting main loop with {self.pzem_reader.read_interval}s interval")
+
             while True:
-                # Read PZEM data
-                pzem_data = self.get_pzem_data()
+                # Wait for the next PZEM reading
+                pzem_data = await self.get_pzem_data()
 
                 if pzem_data and 'voltage' in pzem_data:
                     # Send to OPC-UA server
@@ -376,20 +491,14 @@ class EnergyMonitor:
 
                         # Log every N readings
                         if reading_count % log_every_n == 0:
-                            self.logger.info(f"Reading #{reading_count}: "
-                                          f"V={pzem_data['voltage']:.1f}V, "
-                                          f"I={pzem_data['current']:.3f}A, "
-                                          f"P={pzem_data['power']:.0f}W, "
-                                          f"E={pzem_data['energy']:.0f}Wh, "
-                                          f"F={pzem_data['frequency']:.1f}Hz, "
-                                          f"PF={pzem_data['power_factor']:.2f}")
+                            self.logger.info("Reading #%d: V=%.1fV, I=%.3fA, P=%.0fW, E=%.0fWh, F=%.1fHz, PF=%.2f",
+                                             reading_count, pzem_data['voltage'], pzem_data['current'],
+                                             pzem_data['power'], pzem_data['energy'],
+                                             pzem_data['frequency'], pzem_data['power_factor'])
                     else:
                         self.logger.warning("Failed to send data to OPC-UA server")
                 else:
-                    self.logger.warning(f"No valid PZEM data available: {pzem_data}")
-
-                # Wait for next reading
-                await asyncio.sleep(sample_interval)
+                    self.logger.warning("No valid PZEM data available: %s", pzem_data)
 
         except KeyboardInterrupt:
             self.logger.info("Stopping due to keyboard interrupt...")
@@ -399,7 +508,10 @@ class EnergyMonitor:
         finally:
             # Stop PZEM reading
             self.logger.info("Shutting down...")
-            self.pzem_reader.running = False
+            self.pzem_reader.stop()
+            if self.read_task:
+                await asyncio.gather(self.read_task, return_exceptions=True)
+            self.pzem_reader.close()
             if self.opcua_client:
                 try:
                     await self.opcua_client.disconnect()
@@ -452,7 +564,7 @@ def print_startup_info(config: ConfigManager):
     print(f"🌍 Environment: {config.get('application', 'environment')}")
     print(f"🔌 OPC-UA Server: {config.get('opcua', 'server_url')}")
     print(f"⚡ PZEM Device: {config.get('pzem', 'device')}")
-    print(f"⏱️  Sample Interval: {config.get('timing', 'sample_interval')}s")
+    print(f"⏱️  Sample Interval: {config.get('timing', 'pzem_read_interval')}s")
     print(f"📊 Log Level: {config.get('logging', 'level')}")
     print("="*60 + "\n")
 
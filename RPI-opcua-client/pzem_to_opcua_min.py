@@ -23,12 +23,18 @@ HOW WE BUILD IT (STEP-BY-STEP)
    - Either read raw frames from serial (single request → 25-byte response)
    - Or synthesize data in "simulate" mode for local testing.
 3) Connect an asyncua Client to the OPC UA endpoint.
-4) Resolve the target variable nodes by browsing:
+4) Resolve the target variable nodes under:
    <machine_root> / Monitoring / Consumption / Electricity / Main
-   and pick the 4 variables by browseName.
+   with one TranslateBrowsePathsToNodeIds request (browseNames in the
+   machine root's namespace), falling back to browsing segment by segment
+   and picking the 4 variables by browseName.
 5) Enter a loop:
-   - Read sensor data, scale with config factors
-   - Write doubles to the four OPC UA nodes
+   - Read sensor data (frames failing the Modbus CRC are rejected);
+     skip the write when the read failed, else scale with config factors
+   - Every probe_every_n cycles, probe the session and reconnect if it died
+   - Write doubles to the OPC UA nodes: all four every cycle in "poll" mode;
+     in "on_change" mode only those that moved past the deadband, plus all
+     four on every heartbeat (heartbeat_every_n cycles / force_heartbeat_sec)
    - Sleep for configured sample interval
 6) On Ctrl+C / cancellation, disconnect gracefully.
 
@@ -40,13 +46,29 @@ application:
   quiet_third_party: bool (mute asyncua/websockets/etc. to WARNING)
   log_values: bool (periodic value logs)
   log_values_every_n: int (log every N cycles when log_values=true)
+  log_queue_size: int (bounded log queue; oldest records dropped when full, default 1000)
 
 opcua:
   server_url: opc.tcp://...
   machine_root_nodeid: "ns=...;i=..." of the machine root
+  namespace_uri: optional namespace URI of the path/variable browseNames; its
+                 index is looked up at resolve time and must match exactly
+                 (default: the machine root's namespace, bare-name browse fallback)
   channel_path: ["Monitoring", "Consumption", "Electricity", "Main"]
   variables: ["AcVoltagePe", "AcCurrentPe", "AcActivePowerPe", "AcActiveEnergyTotalImportHp"]
   retries, retry_delay_sec: connection retry policy
+  retry_delay_max_sec: cap for the exponential retry delay (default 60)
+  connect_timeout_sec: give up on a single connect attempt after this (default 5)
+  probe_every_n: read ServerStatus every N cycles and reconnect if it fails
+                 (default 12, 0 disables)
+  write_timeout_sec: bound for one batched write (default 2)
+  breaker_cooldown_sec: after a write times out or fails, skip writes for this
+                        long unless a reconnect succeeds first (default 30)
+  publish_mode: "poll" (default, write every cycle) | "on_change" (opt-in: write
+                only values that moved past scales.deadband; downstream consumers
+                should subscribe via CreateMonitoredItems instead of polling)
+  force_heartbeat_sec: in on_change mode, write all variables at least this
+                       often (default 60, 0 disables)
 
 pzem:
   device: /dev/ttyAMA0
@@ -57,9 +79,14 @@ pzem:
 
 scales:
   voltage_scale, current_scale, power_scale, energy_scale
+  deadband: {browseName: min change} — in on_change mode, smaller changes
+            are not written (default {}: write every value every cycle).
+            Thresholds are in scaled units, i.e. compared after *_scale is
+            applied (with current_scale 0.001, 0.000001 means 1 mA raw)
 
 timing:
   sample_interval_sec: 5.0
+  heartbeat_every_n: 12 (write all variables every N cycles regardless of deadband)
 
 EXTENDING
 ---------
@@ -75,15 +102,27 @@ EXTENDING
 import asyncio
 import json
 import logging
+import logging.handlers
+import queue
+import random
 import struct
+import sys
 import time
+from array import array
 from dataclasses import dataclass
+from datetime import datetime, timezone
 from pathlib import Path
-from typing import Dict, Optional
+from typing import Dict, Optional, Tuple, Union
 
 import serial
 from asyncua import Client, ua
 
+try:
+    # uvloop roughly halves event-loop overhead on Linux; main() warns if it is missing
+    import uvloop  # type: ignore
+except ImportError:
+    uvloop = None
+
 
 def load_config(path: str = "config.json") -> Dict:
     """Load JSON config or raise if missing."""
@@ -94,19 +133,59 @@ def load_config(path: str = "config.json") -> Dict:
         return json.load(f)
 
 
-def setup_logging(cfg: Dict) -> None:
+def _put_drop_oldest(q: queue.Queue, item) -> None:
+    """Put item on a bounded queue without blocking, discarding the oldest entries to make room."""
+    while True:
+        try:
+            q.put_nowait(item)
+            return
+        except queue.Full:
+            try:
+                q.get_nowait()
+            except queue.Empty:
+                pass
+
+
+class _DropOldestQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler over a bounded queue: when full, the oldest record is dropped instead of blocking."""
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        _put_drop_oldest(self.queue, record)
+
+
+class _DropOldestQueueListener(logging.handlers.QueueListener):
+    """QueueListener whose stop sentinel also drops the oldest record, so stop() never raises queue.Full."""
+
+    def enqueue_sentinel(self) -> None:
+        _put_drop_oldest(self.queue, self._sentinel)
+
+
+def setup_logging(cfg: Dict) -> logging.handlers.QueueListener:
     """
     Configure console logging:
     - Our root logger uses 'log_level' (INFO by default)
     - Third-party libraries are muted to WARNING when 'quiet_third_party' is true
+    - Records go through a bounded queue (application.log_queue_size) and are
+      written by a QueueListener thread, so the event loop never blocks on I/O
+
+    Returns the started listener; call .stop() on shutdown to flush it.
     """
     app = cfg.get("application", {})
     lvl_name = str(app.get("log_level", "INFO")).upper()
     verbose = bool(app.get("verbose", False))
     quiet_third = bool(app.get("quiet_third_party", True))
+    queue_size = int(app.get("log_queue_size", 1000))
 
     level = getattr(logging, lvl_name, logging.INFO)
-    logging.basicConfig(level=level, format="%(asctime)s %(levelname)s: %(message)s")
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter("%(asctime)s %(levelname)s: %(message)s"))
+    log_queue: queue.Queue = queue.Queue(maxsize=max(1, queue_size))
+    queue_handler = _DropOldestQueueHandler(log_queue)
+    # The console handler applies the real format; the queued record carries only the message
+    queue_handler.setFormatter(logging.Formatter("%(message)s"))
+    logging.basicConfig(level=level, handlers=[queue_handler])
+    listener = _DropOldestQueueListener(log_queue, console)
+    listener.start()
 
     # Root logger adopts chosen level; enable DEBUG for our code when verbose
     logging.getLogger().setLevel(logging.DEBUG if verbose else level)
@@ -126,13 +205,54 @@ def setup_logging(cfg: Dict) -> None:
     ]
     for name in third_party_loggers:
         logging.getLogger(name).setLevel(logging.WARNING if quiet_third else level)
+    return listener
 
 
 # ─────────────────────────────────────────────────────────────────
 # 2) Sensor: PZEM reader (native frame)
 # ─────────────────────────────────────────────────────────────────
 
-@dataclass
+# Read-input-registers request for 10 registers from address 0 (CRC included)
+_PZEM_REQ = bytes([0x01, 0x04, 0x00, 0x00, 0x00, 0x0A, 0x70, 0x0D])
+
+# Response layout: 3-byte header, voltage (u16), then current, power and
+# energy as 24-bit big-endian fields read as a high byte plus a low word
+_PZEM_FRAME = struct.Struct(">xxxHBHxBHxBH")
+
+
+def _crc16_table() -> array:
+    """Lookup table for the reflected Modbus CRC-16 polynomial 0xA001."""
+    table = array("H")
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC_TABLE = _crc16_table()
+
+
+def _crc16(buf: bytes) -> int:
+    """Modbus RTU CRC-16 of buf."""
+    crc = 0xFFFF
+    for b in buf:
+        crc = (crc >> 8) ^ _CRC_TABLE[(crc ^ b) & 0xFF]
+    return crc
+
+
+# Simulate mode: (voltage, current, power) for each second of a 6 s cycle.
+# Voltage alternates every second, current every 3 seconds.
+_SIM_TABLE = tuple(
+    (v, c, v * c)
+    for s in range(6)
+    for v in (229.0 + 0.5 * (1 if s % 2 == 0 else -1),)
+    for c in (0.150 + 0.010 * (1 if (s // 3) % 2 == 0 else -1),)
+)
+
+
+@dataclass(slots=True)
 class PzemReading:
     """Single snapshot of electrical readings (engineering units)."""
     voltage: float = 0.0   # V
@@ -161,51 +281,74 @@ class PzemNative:
         self.read_delay = read_delay
         self.simulate = simulate
         self._last_energy = 0.0
+        self._ser: Optional[serial.Serial] = None
 
     @staticmethod
     def _decode_response(buf: bytes) -> Optional[PzemReading]:
         """Decode a 25-byte PZEM response buffer into engineering values."""
         if len(buf) < 25:
             return None
+        # Trailing CRC is little-endian; reject corrupt or misaligned frames
+        if _crc16(buf[:23]) != buf[23] | (buf[24] << 8):
+            return PzemReading(status="CRC fail")
         try:
-            voltage = struct.unpack(">H", buf[3:5])[0] / 10.0            # 0.1 V
-            current = struct.unpack(">I", b"\x00" + buf[5:8])[0] / 1000.0  # mA → A
-            power   = struct.unpack(">I", b"\x00" + buf[9:12])[0] / 10.0   # 0.1 W
-            energy  = float(struct.unpack(">I", b"\x00" + buf[13:16])[0])  # Wh
+            v, i_hi, i_lo, p_hi, p_lo, e_hi, e_lo = _PZEM_FRAME.unpack_from(buf)
+            voltage = v / 10.0                              # 0.1 V
+            current = ((i_hi << 16) | i_lo) / 1000.0        # mA → A
+            power   = ((p_hi << 16) | p_lo) / 10.0          # 0.1 W
+            energy  = float((e_hi << 16) | e_lo)            # Wh
             return PzemReading(voltage, current, power, energy, "OK")
         except Exception:
             return None
 
-    def read(self) -> PzemReading:
+    async def read(self) -> PzemReading:
         """
         Return current sensor reading:
         - Simulate: synthetic but realistic values
-        - Real: send a request, wait briefly, parse a 25-byte response
+        - Real: serial transaction in the default executor, so the event loop
+          (OPC UA keepalives, pending writes) keeps running meanwhile
         """
         if self.simulate:
-            now = time.time()
-            voltage = 229.0 + 0.5 * (1 if int(now) % 2 == 0 else -1)
-            current = 0.150 + 0.010 * (1 if int(now / 3) % 2 == 0 else -1)
-            power = voltage * current
-            # Accumulate energy with sample interval assumption (~5s typical)
-            self._last_energy += power * (5.0 / 3600.0)  # Wh
-            return PzemReading(voltage, current, power, self._last_energy, "SIM")
-
+            return self._read_simulated()
+        return await asyncio.get_running_loop().run_in_executor(None, self._read_serial)
+
+    def _read_simulated(self) -> PzemReading:
+        """Synthesize a reading; energy accumulates between calls."""
+        voltage, current, power = _SIM_TABLE[int(time.time()) % 6]
+        # Accumulate energy with sample interval assumption (~5s typical)
+        self._last_energy += power * (5.0 / 3600.0)  # Wh
+        return PzemReading(voltage, current, power, self._last_energy, "SIM")
+
+    def _read_serial(self) -> PzemReading:
+        """Blocking: send a request, wait briefly, parse a 25-byte response."""
         try:
-            with serial.Serial(self.device, self.baudrate, timeout=self.timeout) as ser:
-                # One command → one response (fixed frame)
-                req = bytes([0x01, 0x04, 0x00, 0x00, 0x00, 0x0A, 0x70, 0x0D])
-                ser.write(req)
-                time.sleep(self.read_delay)
-                resp = ser.read(25)
-                reading = self._decode_response(resp)
-                if reading:
-                    self._last_energy = reading.energy
-                    return reading
+            # The port stays open between reads; it is reopened after an error
+            if self._ser is None or not self._ser.is_open:
+                self._ser = serial.Serial(self.device, self.baudrate, timeout=self.timeout)
+            ser = self._ser
+            # One command → one response (fixed frame)
+            ser.reset_input_buffer()
+            ser.write(_PZEM_REQ)
+            time.sleep(self.read_delay)
+            resp = ser.read(25)
+            reading = self._decode_response(resp)
+            if reading is None:
                 return PzemReading(status="No response/Decode fail")
+            if reading.status == "OK":
+                self._last_energy = reading.energy
+            return reading
         except Exception as e:
+            self.close()
             return PzemReading(status=f"Serial error: {e}")
 
+    def close(self) -> None:
+        """Close the serial port if it is open."""
+        if self._ser is not None:
+            try:
+                self._ser.close()
+            finally:
+                self._ser = None
+
 
 # ─────────────────────────────────────────────────────────────────
 # 3) OPC UA writer (Umati PR Generic channel)
@@ -227,25 +370,116 @@ class UmatiPrWriter:
             channel_path: list[str],
             variable_names: list[str],
             verbose: bool = False,
+            connect_timeout: float = 5.0,
+            deadband: Optional[Dict[str, float]] = None,
+            heartbeat_every_n: int = 0,
+            heartbeat_sec: float = 0.0,
+            namespace_uri: Optional[str] = None,
+            write_timeout: float = 2.0,
+            breaker_cooldown: float = 30.0,
     ) -> None:
         self.client = client
         self.machine_root_id = machine_root_id
         self.channel_path = channel_path
         self.variable_names = variable_names
         self.verbose = verbose
+        self.connect_timeout = connect_timeout
+        # BrowseName namespace: resolved from namespace_uri on every resolve_nodes()
+        # (indices can change across server restarts), else the machine root's index
+        self.namespace_uri = namespace_uri
+        self._ns = machine_root_id.NamespaceIndex
+        # Circuit breaker: after a write times out or raises, writes are skipped for
+        # _cooldown seconds and _probe_at schedules the next _ensure_connected() (see should_probe)
+        self.write_timeout = write_timeout
+        self._cooldown = breaker_cooldown
+        self._fail_ts = 0.0
+        self._probe_at = 0.0
         self.nodes: Dict[str, "asyncua.Node"] = {}
+        self.nodeids: Dict[str, ua.NodeId] = {}
+        # Reused every cycle: latest values by browseName and the WriteRequest body
+        self._values: Dict[str, float] = dict.fromkeys(variable_names, 0.0)
+        self._write_params: Optional[ua.WriteParameters] = None
+        # Deadband: skip a variable whose value moved less than deadband[name] since the
+        # last successful write; every heartbeat_every_n cycles, or once heartbeat_sec
+        # has passed since the last full write, all variables are sent
+        self.deadband: Dict[str, float] = dict(deadband or {})
+        self.heartbeat_every_n = heartbeat_every_n
+        self.heartbeat_sec = heartbeat_sec
+        self._last_full = 0.0
+        self._last: Dict[str, float] = {}
+        self._cycle = 0
+        # Browse fallback: {parent NodeId: {(nsIdx, name) and name: child node}}
+        self._children: Dict[ua.NodeId, Dict[Union[str, Tuple[int, str]], "asyncua.Node"]] = {}
+
+    async def _children_by_browse_name(self, parent) -> Dict[Union[str, Tuple[int, str]], "asyncua.Node"]:
+        """
+        Map child browseNames → node, reading all child BrowseNames in one
+        request (cached per parent). Each child is keyed both by its
+        (NamespaceIndex, Name) tuple and by its bare Name.
+        """
+        by_name = self._children.get(parent.nodeid)
+        if by_name is not None:
+            return by_name
+        children = await parent.get_children()
+        params = ua.ReadParameters()
+        for n in children:
+            rv = ua.ReadValueId()
+            rv.NodeId = n.nodeid
+            rv.AttributeId = ua.AttributeIds.BrowseName
+            params.NodesToRead.append(rv)
+        results = await self.client.uaclient.read(params) if children else []
+        by_name = {}
+        for n, dv in zip(children, results):
+            if dv.StatusCode.is_good():
+                qn = dv.Value.Value
+                # First match wins, as with the previous sequential scan
+                by_name.setdefault((qn.NamespaceIndex, qn.Name), n)
+                by_name.setdefault(qn.Name, n)
+        self._children[parent.nodeid] = by_name
+        return by_name
 
     async def _find_child_by_browse_name(self, parent, browse_name: str):
-        """Return the child node whose browseName matches exactly, else None."""
-        refs = await parent.get_children()
-        for n in refs:
-            qn = await n.read_browse_name()
-            if qn.Name == browse_name:
-                return n
-        return None
+        """
+        Return the child node whose browseName matches exactly, else None.
+        With a namespace_uri configured the namespace index must match too.
+        """
+        key = (self._ns, browse_name) if self.namespace_uri else browse_name
+        return (await self._children_by_browse_name(parent)).get(key)
 
-    async def resolve_nodes(self) -> bool:
-        """Walk the channel_path and pick variable nodes by browseName."""
+    async def _translate_browse_paths(self) -> Optional[Dict[str, ua.NodeId]]:
+        """
+        Resolve every variable with a single TranslateBrowsePathsToNodeIds
+        request. BrowseNames are qualified with the configured namespace (or
+        the machine root's); returns None if any path does not resolve.
+        """
+        ns = self._ns
+        paths = []
+        for name in self.variable_names:
+            bp = ua.BrowsePath()
+            bp.StartingNode = self.machine_root_id
+            for segment in [*self.channel_path, name]:
+                el = ua.RelativePathElement()
+                el.ReferenceTypeId = ua.NodeId(ua.ObjectIds.HierarchicalReferences)
+                el.IsInverse = False
+                el.IncludeSubtypes = True
+                el.TargetName = ua.QualifiedName(segment, ns)
+                bp.RelativePath.Elements.append(el)
+            paths.append(bp)
+
+        results = await self.client.uaclient.translate_browsepaths_to_nodeids(paths)
+        nodeids: Dict[str, ua.NodeId] = {}
+        for name, res in zip(self.variable_names, results):
+            if not res.StatusCode.is_good() or not res.Targets:
+                logging.debug("Browse path to '%s' not resolved: %s", name, res.StatusCode.name)
+                return None
+            target = res.Targets[0].TargetId
+            # TargetId is an ExpandedNodeId; keep a plain NodeId for requests
+            nodeids[name] = ua.NodeId(target.Identifier, target.NamespaceIndex, target.NodeIdType)
+        return nodeids
+
+    async def _browse_nodes(self) -> bool:
+        """Walk the channel_path segment by segment and pick variables by browseName."""
+        self._children.clear()
         root = self.client.get_node(self.machine_root_id)
         cur = root
         for segment in self.channel_path:
@@ -261,47 +495,199 @@ class UmatiPrWriter:
                 logging.error("Variable '%s' not found under channel", name)
                 return False
             self.nodes[name] = node
+            self.nodeids[name] = node.nodeid
+        return True
+
+    async def resolve_nodes(self) -> bool:
+        """Resolve variable nodes by browse path, falling back to walking the channel_path."""
+        if self.namespace_uri:
+            try:
+                self._ns = await self.client.get_namespace_index(self.namespace_uri)
+            except Exception as e:
+                logging.error("Namespace '%s' not found on server: %s", self.namespace_uri, e)
+                return False
+        try:
+            nodeids = await self._translate_browse_paths()
+        except Exception as e:
+            logging.debug("TranslateBrowsePathsToNodeIds failed: %s", e)
+            nodeids = None
+
+        if nodeids is not None:
+            for name, nodeid in nodeids.items():
+                self.nodes[name] = self.client.get_node(nodeid)
+                self.nodeids[name] = nodeid
+        elif not await self._browse_nodes():
+            return False
+
+        # Preallocate one WriteValue per variable; writes only swap in new DataValues
+        params = ua.WriteParameters()
+        for name in self.variable_names:
+            wv = ua.WriteValue()
+            wv.NodeId = self.nodeids[name]
+            wv.AttributeId = ua.AttributeIds.Value
+            params.NodesToWrite.append(wv)
+        self._write_params = params
+        # Fresh session: the first write after (re)resolving sends every variable
+        self._last.clear()
 
         if self.verbose:
-            # Optional: inspect access levels at DEBUG level
-            for name, node in self.nodes.items():
-                attrs = await node.read_attributes(
-                    [ua.AttributeIds.AccessLevel, ua.AttributeIds.UserAccessLevel]
-                )
-                al = int(attrs[0].Value.Value)
-                ual = int(attrs[1].Value.Value)
+            # Optional: inspect access levels at DEBUG level (both attributes of
+            # every node in a single ReadRequest)
+            read_params = ua.ReadParameters()
+            for name in self.variable_names:
+                for attr in (ua.AttributeIds.AccessLevel, ua.AttributeIds.UserAccessLevel):
+                    rv = ua.ReadValueId()
+                    rv.NodeId = self.nodeids[name]
+                    rv.AttributeId = attr
+                    read_params.NodesToRead.append(rv)
+            results = await self.client.uaclient.read(read_params)
+            for idx, name in enumerate(self.variable_names):
+                al = int(results[2 * idx].Value.Value)
+                ual = int(results[2 * idx + 1].Value.Value)
                 logging.debug(
                     "Node %-34s AccessLevel=0x%02X UserAccessLevel=0x%02X", name, al, ual
                 )
         return True
 
+    async def _ensure_connected(self) -> bool:
+        """
+        Cheap liveness probe: read ServerStatus/State. If that fails, drop the
+        session, reconnect and resolve the nodes again. Returns False if the
+        server is still unreachable. A successful reconnect closes the write
+        circuit breaker. A failed one, whether the outage was found by a failed
+        write or by the periodic probe, opens it and schedules the next probe
+        breaker_cooldown_sec later; should_probe() holds off until then.
+        """
+        self._probe_at = 0.0
+        try:
+            await asyncio.wait_for(self.client.nodes.server_state.read_value(), timeout=2.0)
+            return True
+        except Exception as e:
+            logging.warning("OPC UA liveness probe failed (%s); reconnecting", str(e) or type(e).__name__)
+
+        try:
+            await asyncio.wait_for(self.client.disconnect(), timeout=self.connect_timeout)
+        except Exception:
+            pass
+        self._write_params = None
+        try:
+            await asyncio.wait_for(self.client.connect(), timeout=self.connect_timeout)
+            resolved = await self.resolve_nodes()
+        except Exception as e:
+            logging.warning("Reconnect failed: %s", str(e) or type(e).__name__)
+            resolved = False
+        if not resolved:
+            self._fail_ts = time.monotonic()
+            self._probe_at = self._fail_ts + self._cooldown
+            return False
+        logging.info("Reconnected.")
+        self._fail_ts = 0.0
+        return True
+
     async def write_values(self, values: Dict[str, float]) -> bool:
-        """Write each variable individually as Double; return True if all queued writes succeeded."""
+        """
+        Write the variables that moved past their deadband as Double in one
+        WriteRequest; return True if every write succeeded (or none was needed).
+        """
+        if self._fail_ts and time.monotonic() - self._fail_ts < self._cooldown:
+            # Breaker open: do not queue another request behind a stalled session
+            return False
+        params = self._write_params
+        if params is None:
+            logging.error("Nodes not resolved")
+            return False
         try:
             ok = True
-            for name in self.variable_names:
-                node = self.nodes.get(name)
-                if not node:
-                    logging.error("Node not resolved: %s", name)
-                    ok = False
+            now = datetime.now(timezone.utc)
+            self._cycle += 1
+            mono = time.monotonic()
+            heartbeat = (
+                (self.heartbeat_every_n > 0 and self._cycle % self.heartbeat_every_n == 0)
+                or (self.heartbeat_sec > 0 and mono - self._last_full >= self.heartbeat_sec)
+            )
+            last = self._last
+            deadband = self.deadband
+            names = []
+            to_write = []
+            for name, wv in zip(self.variable_names, params.NodesToWrite):
+                val = float(values.get(name, 0.0))
+                prev = last.get(name)
+                if not heartbeat and prev is not None and abs(val - prev) < deadband.get(name, 0.0):
                     continue
-                v = float(values.get(name, 0.0))
-                await node.write_value(ua.Variant(v, ua.VariantType.Double))
+                wv.Value = ua.DataValue(
+                    ua.Variant(val, ua.VariantType.Double),
+                    SourceTimestamp=now,
+                )
+                names.append(name)
+                to_write.append(wv)
+
+            if not to_write:
+                return True
+            if len(to_write) == len(params.NodesToWrite):
+                request = params
+            else:
+                request = ua.WriteParameters()
+                request.NodesToWrite = to_write
+
+            # One round-trip for all changed variables; check each per-node status
+            results = await asyncio.wait_for(self.client.uaclient.write(request), timeout=self.write_timeout)
+            for name, wv, status in zip(names, to_write, results):
+                if status.is_good():
+                    last[name] = wv.Value.Value.Value
+                else:
+                    logging.error("UA write failed for %s: %s", name, status.name)
+                    ok = False
+            if ok and request is params:
+                self._last_full = mono
             return ok
         except Exception as e:
-            logging.error("UA write exception: %s", e)
+            logging.error(
+                "UA write exception: %s; pausing writes for %.0f s", str(e) or type(e).__name__, self._cooldown
+            )
+            self._fail_ts = self._probe_at = time.monotonic()
             return False
 
+    def should_probe(self, periodic: bool) -> bool:
+        """
+        Whether main should run _ensure_connected() this cycle. While a failed
+        write or reconnect has a probe scheduled, only that schedule counts and
+        the periodic probe is skipped; otherwise the periodic probe decides.
+        """
+        if self._probe_at:
+            return self._probe_at <= time.monotonic()
+        return periodic
+
+    async def write_values_fast(self, v: float, i: float, p: float, e: float) -> bool:
+        """Write the four PZEM readings through the reused values dict (no per-cycle payload)."""
+        values = self._values
+        values["AcVoltagePe"] = v
+        values["AcCurrentPe"] = i
+        values["AcActivePowerPe"] = p
+        values["AcActiveEnergyTotalImportHp"] = e
+        return await self.write_values(values)
+
 
 # ─────────────────────────────────────────────────────────────────
 # 4) Orchestration & Main loop
 # ─────────────────────────────────────────────────────────────────
 
 async def main() -> None:
-    """Top-level orchestration: config → sensor → connect → resolve → loop → disconnect."""
+    """Top-level orchestration: config → logging → run_bridge(), flushing the log queue on every exit."""
     cfg = load_config()
-    setup_logging(cfg)
+    listener = setup_logging(cfg)
+    try:
+        await run_bridge(cfg)
+    finally:
+        # Give-up, cancellation during connect/backoff, bad config values, Ctrl+C:
+        # queued log records are flushed on all of them
+        listener.stop()
+
+
+async def run_bridge(cfg: Dict) -> None:
+    """Sensor → connect → resolve → loop → disconnect."""
     log = logging.getLogger("main")
+    if uvloop is None:
+        log.warning("uvloop not installed; falling back to default loop")
 
     app_cfg = cfg.get("application", {})
     verbose = bool(app_cfg.get("verbose", False))
@@ -324,11 +710,14 @@ async def main() -> None:
     i_scale = float(sc.get("current_scale", 1.0))
     p_scale = float(sc.get("power_scale", 1.0))
     e_scale = float(sc.get("energy_scale", 1.0))
+    deadband = {str(k): float(x) for k, x in sc.get("deadband", {}).items()}
+    heartbeat_every_n = int(cfg.get("timing", {}).get("heartbeat_every_n", 12))  # full write every N cycles
 
     # OPC UA settings
     ua_cfg = cfg.get("opcua", {})
     endpoint = ua_cfg.get("server_url", "opc.tcp://127.0.0.1:4840")
     machine_root = ua_cfg.get("machine_root_nodeid", "ns=1;i=74000")
+    namespace_uri = ua_cfg.get("namespace_uri") or None
     channel_path = ua_cfg.get("channel_path", ["Monitoring", "Consumption", "Electricity", "Main"])
     var_names = ua_cfg.get(
         "variables",
@@ -336,6 +725,19 @@ async def main() -> None:
     )
     retries = int(ua_cfg.get("retries", 5))
     retry_delay = float(ua_cfg.get("retry_delay_sec", 3.0))
+    retry_delay_max = float(ua_cfg.get("retry_delay_max_sec", 60.0))
+    connect_timeout = float(ua_cfg.get("connect_timeout_sec", 5.0))
+    probe_every_n = int(ua_cfg.get("probe_every_n", 12))  # liveness probe every N cycles (0 = off)
+    write_timeout = float(ua_cfg.get("write_timeout_sec", 2.0))
+    breaker_cooldown = float(ua_cfg.get("breaker_cooldown_sec", 30.0))
+    publish_mode = str(ua_cfg.get("publish_mode", "poll")).lower()
+    force_heartbeat_sec = float(ua_cfg.get("force_heartbeat_sec", 60.0))
+    if publish_mode not in ("poll", "on_change"):
+        log.warning("Unknown opcua.publish_mode %r; using 'poll'", publish_mode)
+        publish_mode = "poll"
+    if publish_mode == "poll":
+        # Every value every cycle; the deadband only applies in on_change mode
+        deadband = {}
 
     log.info("Starting PZEM → OPC UA writer")
     log.info("Connecting to OPC UA: %s", endpoint)
@@ -343,10 +745,10 @@ async def main() -> None:
     client = Client(url=endpoint)
     writer: Optional[UmatiPrWriter] = None
 
-    # Connection & node resolution with simple retry
+    # Connection & node resolution with bounded attempts and exponential backoff
     for attempt in range(1, retries + 1):
         try:
-            await client.connect()
+            await asyncio.wait_for(client.connect(), timeout=connect_timeout)
             log.info("Connected.")
             writer = UmatiPrWriter(
                 client=client,
@@ -354,57 +756,90 @@ async def main() -> None:
                 channel_path=channel_path,
                 variable_names=var_names,
                 verbose=verbose,
+                connect_timeout=connect_timeout,
+                deadband=deadband,
+                heartbeat_every_n=heartbeat_every_n,
+                heartbeat_sec=force_heartbeat_sec if publish_mode == "on_change" else 0.0,
+                namespace_uri=namespace_uri,
+                write_timeout=write_timeout,
+                breaker_cooldown=breaker_cooldown,
             )
             if not await writer.resolve_nodes():
                 raise RuntimeError("Node resolution failed.")
             break
         except Exception as e:
-            logging.warning("Connect/resolve failed (attempt %d/%d): %s", attempt, retries, e)
+            # TimeoutError from wait_for has an empty message; name the type instead
+            logging.warning("Connect/resolve failed (attempt %d/%d): %s", attempt, retries, str(e) or type(e).__name__)
             try:
-                await client.disconnect()
+                # A half-open session would otherwise stall the teardown as well
+                await asyncio.wait_for(client.disconnect(), timeout=connect_timeout)
             except Exception:
                 pass
             writer = None
             if attempt < retries:
-                await asyncio.sleep(retry_delay)
+                # Jitter keeps several clients from retrying in lockstep after a server restart
+                delay = min(retry_delay_max, retry_delay * 2 ** (attempt - 1))
+                delay *= 0.5 + random.random()
+                await asyncio.sleep(delay)
             else:
                 # Give up after the last attempt
                 return
 
     sample = float(cfg.get("timing", {}).get("sample_interval_sec", 5.0))
     tick = 0
+    since_probe = 0  # cycles since the last liveness probe (counted on every path)
+    # Previous cycle's OPC UA write; it runs while the next sensor read is in progress
+    pending_write: Optional[asyncio.Task] = None
+
+    # Bind hot-loop callables to locals once (no per-cycle module/attribute lookups)
+    # and precompute the log modulus (no per-cycle max() call)
+    _sleep = asyncio.sleep
+    _create_task = asyncio.create_task
+    _read = pzem.read
+    _every = max(1, values_every_n)
 
     try:
         while True:
             # 1) Read raw
-            r = pzem.read()
+            r = await _read()
+
+            # Collect the previous write before queueing a new one on the same payload
+            if pending_write is not None:
+                if not await pending_write:
+                    logging.warning("Write returned not ok")
+                pending_write = None
+
             if r.status not in ("OK", "SIM"):
+                # Keep the last good values on the server rather than writing zeros
                 logging.warning("PZEM status: %s", r.status)
+                await _sleep(sample)
+                continue
 
             # 2) Scale to engineering units expected by the model
-            v = float(r.voltage) * v_scale
-            i = float(r.current) * i_scale
-            p = float(r.power) * p_scale
-            e = float(r.energy) * e_scale
-
-            # 3) Prepare payload by browseName
-            payload = {
-                "AcVoltagePe": v,
-                "AcCurrentPe": i,
-                "AcActivePowerPe": p,
-                "AcActiveEnergyTotalImportHp": e,
-            }
-
-            # 4) Write to OPC UA
-            if writer and not await writer.write_values(payload):
-                logging.warning("Write returned not ok")
+            #    (PzemReading fields are already floats and the scales are float locals)
+            v = r.voltage * v_scale
+            i = r.current * i_scale
+            p = r.power * p_scale
+            e = r.energy * e_scale
+
+            # 3) Write to OPC UA (values are mapped to browseNames by the writer);
+            #    every probe_every_n cycles, or when a failed write/reconnect scheduled a
+            #    retry and it is due, check the session first and reconnect if it died
+            since_probe += 1
+            if writer and writer.should_probe(probe_every_n > 0 and since_probe >= probe_every_n):
+                since_probe = 0
+                if not await writer._ensure_connected():
+                    await _sleep(sample)
+                    continue
+            if writer:
+                pending_write = _create_task(writer.write_values_fast(v, i, p, e))
 
             # Optional: periodic value logs (DEBUG only when enabled)
             tick += 1
-            if log_values and (tick % max(1, values_every_n) == 0):
+            if log_values and (tick % _every == 0):
                 logging.debug("V=%.1f V, I=%.3f A, P=%.1f W, E=%.3f Wh", v, i, p, e)
 
-            await asyncio.sleep(sample)
+            await _sleep(sample)
 
     except asyncio.CancelledError:
         # Soft cancellation (systemd/compose stop) without stack traces
@@ -413,6 +848,9 @@ async def main() -> None:
         # Manual stop (Ctrl+C)
         log.info("Stopping (Ctrl+C)…")
     finally:
+        if pending_write is not None:
+            pending_write.cancel()
+        pzem.close()
         # Always attempt a clean disconnect
         try:
             await client.disconnect()
@@ -422,15 +860,15 @@ async def main() -> None:
 
 
 if __name__ == "__main__":
-    # uvloop is optional; improves event loop performance on Linux
-    try:
-        import uvloop  # type: ignore
-        uvloop.install()
-    except Exception:
-        pass
-
     # Suppress asyncio's final KeyboardInterrupt stack trace
     try:
-        asyncio.run(main())
+        if uvloop is not None and sys.version_info >= (3, 11):
+            # Runner takes the loop factory directly, no global policy change
+            with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+                runner.run(main())
+        else:
+            if uvloop is not None:
+                uvloop.install()
+            asyncio.run(main())
     except KeyboardInterrupt:
         pass
@@ -0,0 +1,74 @@
+"""Tests for the UmatiPrWriter reconnect schedule in pzem_to_opcua_min."""
+
+import asyncio
+import sys
+import time
+import unittest
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from asyncua import ua  # noqa: E402
+
+import pzem_to_opcua_min as m  # noqa: E402
+
+
+class _DeadServerClient:
+    """Client stand-in for a server that is gone: the probe and reconnect both fail."""
+
+    def __init__(self):
+        self.probes = 0
+        self.connects = 0
+        self.nodes = SimpleNamespace(server_state=SimpleNamespace(read_value=self._read_state))
+
+    async def _read_state(self):
+        self.probes += 1
+        raise ConnectionError("connection lost")
+
+    async def connect(self):
+        self.connects += 1
+        raise ConnectionError("connection refused")
+
+    async def disconnect(self):
+        pass
+
+
+class ReconnectScheduleTest(unittest.TestCase):
+    def setUp(self):
+        self.client = _DeadServerClient()
+        self.writer = m.UmatiPrWriter(
+            client=self.client,
+            machine_root_id=ua.NodeId(74000, 1),
+            channel_path=["Monitoring", "Consumption", "Electricity", "Main"],
+            variable_names=["AcVoltagePe"],
+            connect_timeout=0.5,
+            breaker_cooldown=30.0,
+        )
+
+    def _should_probe_at(self, now: float, periodic: bool) -> bool:
+        with mock.patch.object(m.time, "monotonic", return_value=now):
+            return self.writer.should_probe(periodic)
+
+    def test_periodic_probe_decides_when_nothing_is_scheduled(self):
+        self.assertTrue(self.writer.should_probe(True))
+        self.assertFalse(self.writer.should_probe(False))
+
+    def test_failed_reconnect_waits_for_scheduled_probe(self):
+        # Outage found by the periodic probe (no failed write beforehand)
+        before = time.monotonic()
+        self.assertFalse(asyncio.run(self.writer._ensure_connected()))
+        self.assertEqual((self.client.probes, self.client.connects), (1, 1))
+
+        probe_at = self.writer._probe_at
+        self.assertGreaterEqual(probe_at, before + 30.0)
+        # Periodic probes are held off until the scheduled retry...
+        self.assertFalse(self._should_probe_at(probe_at - 29.0, periodic=True))
+        self.assertFalse(self._should_probe_at(probe_at - 0.001, periodic=True))
+        # ...which then fires whether or not a periodic probe is due
+        self.assertTrue(self._should_probe_at(probe_at, periodic=False))
+
+
+if __name__ == "__main__":
+    unittest.main()